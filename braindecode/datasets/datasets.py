@@ -15,6 +15,7 @@ import glob
 import numpy as np
 import pandas as pd
 import mne
+from mne.parallel import parallel_func
 
 from .base import BaseDataset, BaseConcatDataset
 
@@ -31,13 +32,16 @@ def _find_dataset_in_moabb(dataset_name):
 
 def _fetch_and_unpack_moabb_data(dataset, subject_ids):
     data = dataset.get_data(subject_ids)
+    # same for all runs, so only invert the event ids once
+    event_desc = {v: k for k, v in dataset.event_id.items()}
     raws, subject_ids, session_ids, run_ids = [], [], [], []
     for subj_id, subj_data in data.items():
         for sess_id, sess_data in subj_data.items():
             for run_id, raw in sess_data.items():
                 # set annotation if empty
                 if len(raw.annotations) == 0:
-                    annots = _annotations_from_moabb_stim_channel(raw, dataset)
+                    annots = _annotations_from_moabb_stim_channel(
+                        raw, dataset, event_desc)
                     raw.set_annotations(annots)
                 raws.append(raw)
                 subject_ids.append(subj_id)
@@ -51,13 +55,40 @@ def _fetch_and_unpack_moabb_data(dataset, subject_ids):
     return raws, description
 
 
-def _annotations_from_moabb_stim_channel(raw, dataset):
+def _fetch_and_unpack_moabb_subject(dataset, dataset_name, subject_id,
+                                    cache_dir):
+    if cache_dir is None:
+        return _fetch_and_unpack_moabb_data(dataset, [subject_id])
+    subject_dir = os.path.join(
+        cache_dir, f'{dataset_name}_subject_{subject_id}')
+    description_path = os.path.join(subject_dir, 'description.csv')
+    if os.path.exists(description_path):
+        description = pd.read_csv(
+            description_path, dtype={'session': str, 'run': str})
+        raws = [
+            mne.io.read_raw_fif(
+                os.path.join(subject_dir, f'{i_raw}-raw.fif'), preload=True)
+            for i_raw in range(len(description))]
+    else:
+        raws, description = _fetch_and_unpack_moabb_data(
+            dataset, [subject_id])
+        os.makedirs(subject_dir, exist_ok=True)
+        for i_raw, raw in enumerate(raws):
+            # save as double, so cached data equals freshly fetched data
+            raw.save(os.path.join(subject_dir, f'{i_raw}-raw.fif'),
+                     fmt='double', overwrite=True)
+        # write description last, so an interrupted run is not considered
+        # to be cached
+        description.to_csv(description_path, index=False)
+    return raws, description
+
+
+def _annotations_from_moabb_stim_channel(raw, dataset, event_desc):
     # find events from stim channel
-    events = mne.find_events(raw)
+    events = _find_events(raw)
 
     # get annotations from events
-    event_desc = {k: v for v, k in dataset.event_id.items()}
-    annots = mne.annotations_from_events(events, raw.info['sfreq'], event_desc)
+    annots = _annotations_from_events(events, raw.info['sfreq'], event_desc)
 
     # set trial on and offset given by moabb
     onset, offset = dataset.interval
@@ -66,7 +97,56 @@ def _annotations_from_moabb_stim_channel(raw, dataset):
     return annots
 
 
-def fetch_data_with_moabb(dataset_name, subject_ids):
+def _find_events(raw):
+    # moabb raws have a single stim channel with integer triggers, read it
+    # directly instead of going through mne.find_events
+    stim_picks = mne.pick_types(raw.info, meg=False, stim=True)
+    if len(stim_picks) != 1:
+        return mne.find_events(raw)
+    stim = np.round(raw.get_data(picks=stim_picks)[0]).astype(np.int64)
+    # mne.find_events treats negative triggers differently, leave them to mne
+    if stim.min() < 0:
+        return mne.find_events(raw)
+    # same as mne.find_events with consecutive='increasing': an event starts
+    # wherever the trigger value increases to a nonzero value
+    i_onsets = np.flatnonzero((np.diff(stim) > 0) & (stim[1:] > 0)) + 1
+    # mne.find_events may reject events shorter than two samples, leave
+    # those to mne so the behaviour stays the same
+    i_last_sample = len(stim) - 1
+    too_short = (i_onsets == i_last_sample) | (
+        stim[np.minimum(i_onsets + 1, i_last_sample)] != stim[i_onsets])
+    if too_short.any():
+        return mne.find_events(raw)
+    return np.column_stack(
+        [i_onsets + raw.first_samp, stim[i_onsets - 1], stim[i_onsets]])
+
+
+def _annotations_from_events(events, sfreq, event_desc):
+    # vectorized version of mne.annotations_from_events for a dict event_desc
+    event_sel, event_desc_ = _select_events_based_on_id(events, event_desc)
+    events_sel = events[event_sel]
+    onsets = events_sel[:, 0] / sfreq
+    descriptions = pd.Series(events_sel[:, 2]).map(event_desc_).tolist()
+    durations = np.zeros(len(events_sel))
+    return mne.Annotations(
+        onset=onsets, duration=durations, description=descriptions)
+
+
+def _select_events_based_on_id(events, event_desc):
+    event_desc_ = dict()
+    event_ids = np.unique(events[:, 2])
+    for e in event_ids:
+        trigger = event_desc.get(e)
+        if trigger is not None:
+            event_desc_[e] = trigger
+    event_ids_ = np.fromiter(
+        event_desc_.keys(), dtype=events.dtype, count=len(event_desc_))
+    event_sel = np.nonzero(np.isin(events[:, 2], event_ids_))[0]
+    return event_sel, event_desc_
+
+
+def fetch_data_with_moabb(dataset_name, subject_ids, cache_dir=None,
+                          n_jobs=1):
     # ToDo: update path to where moabb downloads / looks for the data
     """Fetch data using moabb.
 
@@ -76,6 +156,12 @@ def fetch_data_with_moabb(dataset_name, subject_ids):
         the name of a dataset included in moabb
     subject_ids: list(int) | int
         (list of) int of subject(s) to be fetched
+    cache_dir: str | None
+        if given, the annotated raws of each subject are stored as .fif files
+        in this directory and loaded from there on subsequent calls instead of
+        being fetched and annotated again
+    n_jobs: int
+        number of subjects to fetch in parallel
 
     Returns
     -------
@@ -84,7 +170,18 @@ def fetch_data_with_moabb(dataset_name, subject_ids):
     """
     dataset = _find_dataset_in_moabb(dataset_name)
     subject_id = [subject_ids] if isinstance(subject_ids, int) else subject_ids
-    return _fetch_and_unpack_moabb_data(dataset, subject_id)
+    # subjects are independent of each other, so fetch them in parallel
+    parallel, p_fetch, _ = parallel_func(
+        _fetch_and_unpack_moabb_subject, n_jobs)
+    raws_and_descriptions = parallel(
+        p_fetch(dataset, dataset_name, subj_id, cache_dir)
+        for subj_id in subject_id)
+    raws = [raw for subj_raws, _ in raws_and_descriptions
+            for raw in subj_raws]
+    description = pd.concat(
+        [subj_description for _, subj_description in raws_and_descriptions],
+        ignore_index=True)
+    return raws, description
 
 
 class MOABBDataset(BaseConcatDataset):
@@ -95,9 +192,15 @@ class MOABBDataset(BaseConcatDataset):
     dataset_name: name of dataset included in moabb to be fetched
     subject_ids: list(int) | int
         (list of) int of subject(s) to be fetched
+    cache_dir: str | None
+        directory to cache the fetched raws in, see
+        :func:`fetch_data_with_moabb`
+    n_jobs: int
+        number of subjects to fetch in parallel
     """
-    def __init__(self, dataset_name, subject_ids):
-        raws, description = fetch_data_with_moabb(dataset_name, subject_ids)
+    def __init__(self, dataset_name, subject_ids, cache_dir=None, n_jobs=1):
+        raws, description = fetch_data_with_moabb(
+            dataset_name, subject_ids, cache_dir=cache_dir, n_jobs=n_jobs)
         all_base_ds = [BaseDataset(raw, row)
                        for raw, (_, row) in zip(raws, description.iterrows())]
         super().__init__(all_base_ds)
@@ -1,7 +1,9 @@
-import numpy as np
-from numpy.random import RandomState
+import queue
+import threading
 
-from braindecode.util import get_balanced_batches
+import numpy as np
+from numpy.random import default_rng
+from numpy.lib.stride_tricks import sliding_window_view
 
 
 class CropsFromTrialsIterator(object):
@@ -25,9 +27,27 @@ class CropsFromTrialsIterator(object):
         Number of predictions ConvNet makes per one input. Can be computed
         by making a forward pass with the given input time length, the
         output length in 3rd dimension is n_preds_per_input.
-    seed: int
-        Random seed for initialization of `numpy.RandomState` random generator
-        that shuffles the batches.
+    seed: int | sequence of int
+        Random seed for initialization of `numpy.random.Generator` random
+        generator that shuffles the batches.
+    prefetch: int
+        Number of batches created ahead of time in a background thread while
+        the current batch is being used. 0 creates batches only on request.
+    dtype: numpy.dtype | None
+        Data type of the input batches, trials are cast while being copied
+        into the batch. None keeps the data type of the trials.
+    reuse_buffers: bool
+        If True, batches are written into a few arrays that are allocated
+        once per call of `get_batches` and then reused. A batch is then only
+        valid until the next batch is requested, so it has to be used or
+        copied (e.g., to the GPU) before that.
+
+    Notes
+    -----
+    Trials given as a list of arrays are copied into a single zero-padded
+    array of this data type on every call of `get_batches`, so changes to
+    the trials are seen by the next call. Trials given as one array are used
+    without a copy.
     
     See Also
     --------
@@ -40,32 +60,78 @@ class CropsFromTrialsIterator(object):
         input_time_length,
         n_preds_per_input,
         seed=(2017, 6, 28),
+        prefetch=2,
+        dtype=np.float32,
+        reuse_buffers=False,
     ):
         self.batch_size = batch_size
         self.input_time_length = input_time_length
         self.n_preds_per_input = n_preds_per_input
         self.seed = seed
-        self.rng = RandomState(self.seed)
+        self.prefetch = prefetch
+        self.dtype = dtype
+        self.reuse_buffers = reuse_buffers
+        self.rng = default_rng(self.seed)
+        self._block_cache = {}
 
     def reset_rng(self):
-        self.rng = RandomState(self.seed)
+        # reseed in place, so references to self.rng stay valid
+        self.rng.bit_generator.state = default_rng(
+            self.seed).bit_generator.state
 
     def get_batches(self, dataset, shuffle):
+        i_trial_stops = np.fromiter(
+            (trial.shape[1] for trial in dataset.X),
+            dtype=np.int64,
+            count=len(dataset.X),
+        )
+        # blocks only depend on the trial lengths, so reuse them across epochs
+        cache_key = (self.input_time_length, self.n_preds_per_input,
+                     i_trial_stops.tobytes())
+        if cache_key not in self._block_cache:
+            self._block_cache[cache_key] = (
+                self._compute_i_trial_start_stop_block(i_trial_stops))
+        X, y = self._stack_dataset(dataset)
+        i_trial_start_stop_block = self._block_cache[cache_key]
+        # balanced batches (maximum size difference 1) as in
+        # get_balanced_batches
+        n_blocks = len(i_trial_start_stop_block)
+        n_batches = max(1, int(np.round(n_blocks / float(self.batch_size))))
+        batches = self._yield_block_batches(
+            X, y, i_trial_start_stop_block, n_batches, shuffle=shuffle
+        )
+        if self.prefetch > 0:
+            batches = _PrefetchIterator(batches, self.prefetch)
+        return _BatchIterator(batches, n_batches)
+
+    def _stack_dataset(self, dataset):
+        # trials given as a list are copied into one zero-padded array for
+        # this epoch, so the crops of a batch can be gathered with a single
+        # index. the copy is not kept, so later changes of the trials are seen
+        X = _stack_trials(dataset.X, time_axis=1, dtype=self.dtype)
+        if hasattr(dataset.y[0], "__len__"):
+            y = _stack_trials(dataset.y, time_axis=0)
+        else:
+            y = np.asarray(dataset.y)
+        return X, y
+
+    def _compute_i_trial_start_stop_block(self, i_trial_stops):
         # start always at first predictable sample, so
         # start at end of receptive field
         n_receptive_field = self.input_time_length - self.n_preds_per_input + 1
-        i_trial_starts = [n_receptive_field - 1] * len(dataset.X)
-        i_trial_stops = [trial.shape[1] for trial in dataset.X]
+        i_trial_starts = np.full_like(i_trial_stops, n_receptive_field - 1)
 
         # Check whether input lengths ok
-        input_lens = i_trial_stops
-        for i_trial, input_len in enumerate(input_lens):
-            assert input_len >= self.input_time_length, (
-                "Input length {:d} of trial {:d} is smaller than the "
-                "input time length {:d}".format(
-                    input_len, i_trial, self.input_time_length
-                )
+        too_short = i_trial_stops < self.input_time_length
+        i_first_too_short = np.argmax(too_short)
+        assert not too_short[i_first_too_short], (
+            "Input length {:d} of trial {:d} is smaller than the "
+            "input time length {:d}".format(
+                i_trial_stops[i_first_too_short],
+                i_first_too_short,
+                self.input_time_length,
             )
+        )
         start_stop_blocks_per_trial = _compute_start_stop_block_inds(
             i_trial_starts,
             i_trial_stops,
@@ -77,35 +143,152 @@ class CropsFromTrialsIterator(object):
             assert trial_blocks[0][0] == 0
             assert trial_blocks[-1][1] == i_trial_stops[i_trial]
 
-        return self._yield_block_batches(
-            dataset.X, dataset.y, start_stop_blocks_per_trial, shuffle=shuffle
-        )
-
-    def _yield_block_batches(self, X, y, start_stop_blocks_per_trial, shuffle):
         # add trial nr to start stop blocks and flatten at same time
-        i_trial_start_stop_block = [
-            (i_trial, start, stop)
-            for i_trial, block in enumerate(start_stop_blocks_per_trial)
-            for (start, stop) in block
-        ]
-        i_trial_start_stop_block = np.array(i_trial_start_stop_block)
-        if i_trial_start_stop_block.ndim == 1:
-            i_trial_start_stop_block = i_trial_start_stop_block[None, :]
-
-        blocks_per_batch = get_balanced_batches(
-            len(i_trial_start_stop_block),
-            batch_size=self.batch_size,
-            rng=self.rng,
-            shuffle=shuffle,
+        n_blocks_per_trial = np.fromiter(
+            (len(blocks) for blocks in start_stop_blocks_per_trial),
+            dtype=np.int64,
+            count=len(start_stop_blocks_per_trial),
         )
-        for i_blocks in blocks_per_batch:
+        i_trials = np.repeat(
+            np.arange(len(n_blocks_per_trial)), n_blocks_per_trial)
+        start_stop_blocks = np.concatenate(start_stop_blocks_per_trial, axis=0)
+        return np.column_stack([i_trials, start_stop_blocks])
+
+    def _yield_block_batches(
+        self, X, y, i_trial_start_stop_block, n_batches, shuffle
+    ):
+        n_blocks = len(i_trial_start_stop_block)
+        if shuffle:
+            i_all_blocks = self.rng.permutation(n_blocks)
+        else:
+            i_all_blocks = np.arange(n_blocks)
+        blocks_per_batch = np.array_split(i_all_blocks, n_batches)
+        if self.reuse_buffers:
+            # the consumer holds one batch and up to prefetch batches are
+            # waiting for it while the next one is written, so a buffer is
+            # only overwritten once the consumer requested the next batch
+            buffers = [
+                _allocate_batch(
+                    X,
+                    y,
+                    len(blocks_per_batch[0]),
+                    self.input_time_length,
+                    self.n_preds_per_input,
+                    self.dtype,
+                )
+                for _ in range(self.prefetch + 2)
+            ]
+        for i_batch, i_blocks in enumerate(blocks_per_batch):
+            out = None
+            if self.reuse_buffers:
+                buffer_X, buffer_y = buffers[i_batch % len(buffers)]
+                out = (buffer_X[: len(i_blocks)], buffer_y[: len(i_blocks)])
             start_stop_blocks = i_trial_start_stop_block[i_blocks]
             batch = _create_batch_from_i_trial_start_stop_blocks(
-                X, y, start_stop_blocks, self.n_preds_per_input
+                X,
+                y,
+                start_stop_blocks,
+                self.n_preds_per_input,
+                self.dtype,
+                out=out,
             )
             yield batch
 
 
+class _BatchIterator(object):
+    """
+    Iterator over the batches of one call of `get_batches`, which also knows
+    the number of batches.
+    Parameters
+    ----------
+    batches: iterator
+    n_batches: int
+    """
+
+    def __init__(self, batches, n_batches):
+        self._batches = batches
+        self._n_batches = n_batches
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return next(self._batches)
+
+    def __len__(self):
+        return self._n_batches
+
+
+class _PrefetchIterator(object):
+    """
+    Iterates over batches that are created in a background thread, so the
+    next batches are created while the current one is being used.
+    Parameters
+    ----------
+    batches: iterator
+        Iterator creating the batches.
+    prefetch: int
+        Maximum number of batches created ahead of time.
+    """
+
+    def __init__(self, batches, prefetch):
+        self._batches = batches
+        self._queue = queue.Queue(maxsize=prefetch)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._thread is None:
+            # create the first batch on the calling thread and start the
+            # background thread only now, like a generator, so that no random
+            # numbers are drawn before the first batch is requested
+            batch = next(self._batches)
+            self._thread = threading.Thread(
+                target=_produce_batches,
+                args=(self._batches, self._queue, self._stop),
+                daemon=True,
+            )
+            self._thread.start()
+            return batch
+        batch, error = self._queue.get()
+        if error is not None:
+            # the background thread has stopped, so finish like a generator
+            # that raised
+            self._queue.put((None, None))
+            raise error
+        if batch is None:
+            self._queue.put((None, None))
+            raise StopIteration
+        return batch
+
+    def __del__(self):
+        # unblock the background thread if iteration was stopped early
+        self._stop.set()
+
+
+def _produce_batches(batches, batch_queue, stop):
+    def put(item):
+        while not stop.is_set():
+            try:
+                batch_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    try:
+        for batch in batches:
+            if not put((batch, None)):
+                return
+    except Exception as error:
+        put((None, error))
+    else:
+        put((None, None))
+
+
 def _compute_start_stop_block_inds(
     i_trial_starts,
     i_trial_stops,
@@ -127,9 +310,9 @@ def _compute_start_stop_block_inds(
         Check whether predictions fit inside trial
     Returns
     -------
-    start_stop_blocks_per_trial: list of list of (int, int)
-        Per trial, a list of 2-tuples indicating start and stop index
-        of the inputs needed to predict entire trial.
+    start_stop_blocks_per_trial: list of 2darray of int
+        Per trial, an array of shape (n_blocks, 2) indicating start and stop
+        index of the inputs needed to predict entire trial.
     """
     # create start stop indices for all batches still 2d trial -> start stop
     start_stop_blocks_per_trial = []
@@ -142,17 +325,12 @@ def _compute_start_stop_block_inds(
 
         if check_preds_smaller_trial_len:
             # check that block is correct, all predicted samples together
-            # should be the trial samples
-            all_predicted_samples = [
-                range(stop - n_preds_per_input, stop)
-                for _, stop in start_stop_blocks
-            ]
-            # this check takes about 50 ms in performance test
-            # whereas loop itself takes only 5 ms.. deactivate it if not necessary
-            assert np.array_equal(
-                range(i_trial_starts[i_trial], i_trial_stops[i_trial]),
-                np.unique(np.concatenate(all_predicted_samples)),
-            )
+            # should be the trial samples. Consecutive block stops are
+            # n_preds_per_input apart, so the predictions are contiguous and
+            # it suffices to check that they reach both ends of the trial
+            assert len(start_stop_blocks) > 0
+            assert start_stop_blocks[0][1] - n_preds_per_input <= i_trial_start
+            assert start_stop_blocks[-1][1] == i_trial_stop
 
         start_stop_blocks_per_trial.append(start_stop_blocks)
     return start_stop_blocks_per_trial
@@ -174,37 +352,149 @@ def _get_start_stop_blocks_for_trial(
     n_preds_per_input: int
     Returns
     -------
-    start_stop_blocks: list of (int, int)
-        A list of 2-tuples indicating start and stop index
+    start_stop_blocks: 2darray of int
+        Array of shape (n_blocks, 2) indicating start and stop index
         of the inputs needed to predict entire trial.
     """
-    start_stop_blocks = []
-    i_window_stop = i_trial_start  # now when we add sample preds in loop,
-    # first sample of trial corresponds to first prediction
-    while i_window_stop < i_trial_stop:
-        i_window_stop += n_preds_per_input
-        i_adjusted_stop = min(i_window_stop, i_trial_stop)
-        i_window_start = i_adjusted_stop - input_time_length
-        start_stop_blocks.append((i_window_start, i_adjusted_stop))
-
-    return start_stop_blocks
+    # first sample of trial corresponds to first prediction, every further
+    # block predicts the next n_preds_per_input samples
+    i_window_stops = np.arange(
+        i_trial_start + n_preds_per_input,
+        i_trial_stop + n_preds_per_input,
+        n_preds_per_input,
+    )
+    # last block may overshoot the trial, so clip it to the trial end
+    np.minimum(i_window_stops, i_trial_stop, out=i_window_stops)
+    i_window_starts = i_window_stops - input_time_length
+    return np.stack([i_window_starts, i_window_stops], axis=1)
 
 
 def _create_batch_from_i_trial_start_stop_blocks(
-    X, y, i_trial_start_stop_block, n_preds_per_input=None
+    X, y, i_trial_start_stop_block, n_preds_per_input=None, dtype=None,
+    out=None,
 ):
-    Xs = []
-    ys = []
-    for i_trial, start, stop in i_trial_start_stop_block:
-        Xs.append(X[i_trial][:, start:stop])
-        if not hasattr(y[i_trial], "__len__"):
-            ys.append(y[i_trial])
+    """
+    Create batch of crops from stacked trials.
+    Parameters
+    ----------
+    X: ndarray
+        Trials stacked into one array of shape (n_trials, n_channels, n_times)
+        or (n_trials, n_channels, n_times, 1), see :func:`_stack_trials`.
+    y: ndarray
+        Labels of shape (n_trials,) or per-sample labels stacked into shape
+        (n_trials, n_times).
+    i_trial_start_stop_block: 2darray of int
+        Trial index, start and stop index of each crop.
+    n_preds_per_input: int
+    dtype: numpy.dtype | None
+        Data type of the input batch, None keeps the data type of X.
+    out: (ndarray, ndarray) | None
+        Arrays to write the input batch (without empty fourth dimension) and
+        the labels into, see :func:`_allocate_batch`.
+    Returns
+    -------
+    batch_X: ndarray
+    batch_y: ndarray
+    """
+    i_trials, starts, stops = i_trial_start_stop_block.T
+    input_time_length = stops[0] - starts[0]
+    if dtype is None:
+        dtype = X.dtype
+    if out is None:
+        # gather all crops with one index into a sliding window view,
+        # which does not copy the trials
+        X_windows = np.moveaxis(
+            sliding_window_view(X, input_time_length, axis=2), -1, 3)
+        batch_X = X_windows[i_trials, :, starts].astype(dtype, copy=False)
+    else:
+        # copy crop by crop, so no temporary batch is created
+        batch_X = out[0]
+        for i_crop, (i_trial, start) in enumerate(zip(i_trials, starts)):
+            stop = start + input_time_length
+            batch_X[i_crop] = X[i_trial, :, start:stop]
+    if y.ndim > 1:
+        assert n_preds_per_input is not None
+        if out is None:
+            y_windows = np.moveaxis(
+                sliding_window_view(y, n_preds_per_input, axis=1), -1, 2)
+            batch_y = y_windows[i_trials, stops - n_preds_per_input]
         else:
-            assert n_preds_per_input is not None
-            ys.append(y[i_trial][stop - n_preds_per_input : stop])
-    batch_X = np.array(Xs)
-    batch_y = np.array(ys)
+            batch_y = out[1]
+            for i_crop, (i_trial, stop) in enumerate(zip(i_trials, stops)):
+                batch_y[i_crop] = y[i_trial, stop - n_preds_per_input:stop]
+    elif out is None:
+        batch_y = y[i_trials]
+    else:
+        batch_y = np.take(y, i_trials, axis=0, out=out[1])
     # add empty fourth dimension if necessary
     if batch_X.ndim == 3:
         batch_X = batch_X[:, :, :, None]
     return batch_X, batch_y
+
+
+def _allocate_batch(X, y, batch_size, input_time_length, n_preds_per_input,
+                    dtype=None):
+    """
+    Allocate arrays that batches created from stacked trials can be written
+    into.
+    Parameters
+    ----------
+    X: ndarray
+        Stacked trials, see
+        :func:`_create_batch_from_i_trial_start_stop_blocks`.
+    y: ndarray
+        Stacked labels.
+    batch_size: int
+        Maximum number of crops per batch.
+    input_time_length: int
+    n_preds_per_input: int
+    dtype: numpy.dtype | None
+        Data type of the input batch, None keeps the data type of X.
+    Returns
+    -------
+    batch_X: ndarray
+    batch_y: ndarray
+    """
+    if dtype is None:
+        dtype = X.dtype
+    batch_X = np.empty(
+        (batch_size, X.shape[1], input_time_length) + X.shape[3:], dtype=dtype)
+    if y.ndim > 1:
+        batch_y = np.empty(
+            (batch_size, n_preds_per_input) + y.shape[2:], dtype=y.dtype)
+    else:
+        batch_y = np.empty(batch_size, dtype=y.dtype)
+    return batch_X, batch_y
+
+
+def _stack_trials(trials, time_axis, dtype=None):
+    """
+    Stack trials into one array, shorter trials are padded with zeros at
+    their end.
+    Parameters
+    ----------
+    trials: ndarray or list of ndarray
+        Trials, already stacked trials are returned unchanged.
+    time_axis: int
+        Time axis of each trial, along which trials may differ in length.
+    dtype: numpy.dtype | None
+        Data type of the stacked trials, None keeps the data type of the
+        trials.
+    Returns
+    -------
+    stacked_trials: ndarray
+        Array of shape (n_trials,) + shape of longest trial.
+    """
+    if isinstance(trials, np.ndarray) and trials.dtype != object:
+        return trials
+    trials = [np.asarray(trial) for trial in trials]
+    shape = list(trials[0].shape)
+    shape[time_axis] = max(trial.shape[time_axis] for trial in trials)
+    if dtype is None:
+        dtype = np.result_type(*set(trial.dtype for trial in trials))
+    stacked_trials = np.zeros([len(trials)] + shape, dtype=dtype)
+    for i_trial, trial in enumerate(trials):
+        i_samples = [slice(None)] * trial.ndim
+        i_samples[time_axis] = slice(0, trial.shape[time_axis])
+        stacked_trials[(i_trial,) + tuple(i_samples)] = trial
+    return stacked_trials
@@ -15,6 +15,9 @@ from collections.abc import Iterable
 
 import numpy as np
 
+_CHANNEL_SELECTION_METHODS = (
+    'pick', 'pick_types', 'pick_channels', 'drop_channels')
+
 
 def transform_concat_ds(concat_ds, transforms):
     """Apply a number of transformers to a concat dataset.
@@ -77,7 +80,11 @@ def _transform(raw_or_epochs, transforms):
             if not hasattr(raw_or_epochs, transform):
                 raise AttributeError(
                     f'MNE object does not have {transform} method.')
-            getattr(raw_or_epochs.load_data(), transform)(**transform_kwargs)
+            # channel selection does not need the data, so do not load the
+            # channels that are dropped anyway
+            if transform not in _CHANNEL_SELECTION_METHODS:
+                raw_or_epochs.load_data()
+            getattr(raw_or_epochs, transform)(**transform_kwargs)
 
 
 def zscore(data):
@@ -9,7 +9,9 @@ import pandas as pd
 import pytest
 
 from braindecode.datasets import WindowsDataset, BaseDataset, BaseConcatDataset
-from braindecode.datasets.datasets import fetch_data_with_moabb
+from braindecode.datasets import datasets
+from braindecode.datasets.datasets import (
+    fetch_data_with_moabb, _find_events, _annotations_from_events)
 
 
 @pytest.fixture(scope="module")
@@ -105,3 +107,122 @@ def test_split_concat_dataset(concat_ds_targets):
         assert isinstance(v, BaseConcatDataset)
 
     assert len(concat_ds) == sum([len(v) for v in splits.values()])
+
+
+def test_fetch_data_with_moabb_cache_dir(tmpdir):
+    raws, description = fetch_data_with_moabb(
+        dataset_name="BNCI2014001", subject_ids=4)
+    # first call fills the cache, second call reads from it
+    for _ in range(2):
+        cached_raws, cached_description = fetch_data_with_moabb(
+            dataset_name="BNCI2014001", subject_ids=4, cache_dir=str(tmpdir))
+        pd.testing.assert_frame_equal(cached_description, description)
+        assert len(cached_raws) == len(raws)
+        for cached_raw, raw in zip(cached_raws, raws):
+            np.testing.assert_array_equal(
+                cached_raw.get_data(), raw.get_data())
+            np.testing.assert_array_equal(
+                cached_raw.annotations.description,
+                raw.annotations.description)
+            np.testing.assert_allclose(
+                cached_raw.annotations.onset, raw.annotations.onset)
+            np.testing.assert_allclose(
+                cached_raw.annotations.duration, raw.annotations.duration)
+
+
+class _FakeMOABBDataset(object):
+    # small stand-in for a moabb dataset, so fetching needs no network
+    event_id = {'left_hand': 1, 'right_hand': 2}
+    interval = [0, 1]
+
+    def get_data(self, subjects):
+        data = {}
+        for subject in subjects:
+            rng = np.random.RandomState(subject)
+            stim = np.zeros(500)
+            stim[100:105] = 1
+            stim[300:305] = 2
+            info = mne.create_info(
+                ch_names=['0', 'stim'], sfreq=100, ch_types=['eeg', 'stim'])
+            runs = {}
+            for i_run in range(2):
+                eeg = rng.randn(500)
+                runs[f'run_{i_run}'] = mne.io.RawArray(
+                    data=np.vstack([eeg, stim]), info=info)
+            data[subject] = {'session_T': runs}
+        return data
+
+
+def test_fetch_data_with_moabb_n_jobs(monkeypatch):
+    monkeypatch.setattr(
+        datasets, '_find_dataset_in_moabb',
+        lambda dataset_name: _FakeMOABBDataset())
+    raws, description = fetch_data_with_moabb(
+        dataset_name="Fake", subject_ids=[3, 1, 2])
+    parallel_raws, parallel_description = fetch_data_with_moabb(
+        dataset_name="Fake", subject_ids=[3, 1, 2], n_jobs=2)
+    assert description['subject'].tolist() == [3, 3, 1, 1, 2, 2]
+    pd.testing.assert_frame_equal(parallel_description, description)
+    assert len(parallel_raws) == len(raws)
+    for parallel_raw, raw in zip(parallel_raws, raws):
+        np.testing.assert_array_equal(parallel_raw.get_data(), raw.get_data())
+        np.testing.assert_allclose(
+            parallel_raw.annotations.onset, raw.annotations.onset)
+        np.testing.assert_array_equal(
+            parallel_raw.annotations.description,
+            raw.annotations.description)
+
+
+def _stim_raw(stim, first_samp=7):
+    info = mne.create_info(
+        ch_names=['0', 'stim'], sfreq=100, ch_types=['eeg', 'stim'])
+    data = np.vstack([np.zeros(len(stim)), stim])
+    return mne.io.RawArray(data=data, info=info, first_samp=first_samp)
+
+
+@pytest.mark.parametrize("events", [
+    # event at sample 0
+    [(0, 3, 1), (10, 15, 2)],
+    # one-sample event
+    [(10, 11, 1), (20, 25, 2)],
+    # event on the last sample
+    [(10, 15, 1), (49, 50, 3)],
+    # event until the end of the recording
+    [(10, 15, 1), (45, 50, 3)],
+    # value going up without returning to 0
+    [(10, 15, 1), (15, 20, 2), (20, 25, 4), (30, 35, 1)],
+    # negative triggers
+    [(10, 11, -1), (11, 13, 2)],
+    [(10, 15, -1), (20, 25, 2)],
+    [(10, 15, 2), (15, 20, -1)],
+])
+def test_find_events(events):
+    stim = np.zeros(50)
+    for start, stop, value in events:
+        stim[start:stop] = value
+    raw = _stim_raw(stim)
+    try:
+        expected = mne.find_events(raw)
+    except ValueError:
+        # e.g. events shorter than the shortest_event
+        with pytest.raises(ValueError, match="shortest_event"):
+            _find_events(raw)
+    else:
+        np.testing.assert_array_equal(_find_events(raw), expected)
+
+
+def test_annotations_from_events():
+    events = np.array([[10, 0, 1],
+                       [25, 0, 5],
+                       [40, 0, 2],
+                       [55, 0, 1],
+                       [70, 0, 3],
+                       [85, 0, 7]])
+    # ids 5 and 7 are not in event_desc and have to be dropped
+    event_desc = {1: 'left_hand', 2: 'right_hand', 3: 'feet', 4: 'tongue'}
+    annots = _annotations_from_events(events, 250, event_desc)
+    expected = mne.annotations_from_events(events, 250, event_desc)
+    assert len(annots) == 4
+    np.testing.assert_allclose(annots.onset, expected.onset)
+    np.testing.assert_allclose(annots.duration, expected.duration)
+    np.testing.assert_array_equal(annots.description, expected.description)
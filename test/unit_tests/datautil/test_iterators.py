@@ -0,0 +1,166 @@
+# License: BSD-3
+
+import numpy as np
+import pytest
+
+from braindecode.datautil.iterators import (
+    CropsFromTrialsIterator, _get_start_stop_blocks_for_trial, _stack_trials,
+    _PrefetchIterator)
+from braindecode.datautil.signal_target import SignalAndTarget
+
+
+@pytest.fixture(scope="module")
+def signal_and_target():
+    rng = np.random.RandomState(42)
+    X = [rng.randn(3, n_times).astype(np.float32)
+         for n_times in [100, 120, 135]]
+    y = [0, 1, 0]
+    return SignalAndTarget(X, y)
+
+
+@pytest.mark.parametrize(
+    "i_trial_start,i_trial_stop,input_time_length,n_preds_per_input",
+    [(9, 100, 10, 1), (9, 100, 30, 21), (20, 100, 30, 10), (29, 30, 30, 1)])
+def test_get_start_stop_blocks_for_trial(
+        i_trial_start, i_trial_stop, input_time_length, n_preds_per_input):
+    expected = []
+    i_window_stop = i_trial_start
+    while i_window_stop < i_trial_stop:
+        i_window_stop += n_preds_per_input
+        i_adjusted_stop = min(i_window_stop, i_trial_stop)
+        expected.append(
+            (i_adjusted_stop - input_time_length, i_adjusted_stop))
+    start_stop_blocks = _get_start_stop_blocks_for_trial(
+        i_trial_start, i_trial_stop, input_time_length, n_preds_per_input)
+    assert start_stop_blocks.shape == (len(expected), 2)
+    np.testing.assert_array_equal(start_stop_blocks, np.array(expected))
+
+
+def test_prefetch_gives_same_batches(signal_and_target):
+    iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10, prefetch=0)
+    prefetch_iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10, prefetch=2)
+    batches = list(iterator.get_batches(signal_and_target, shuffle=True))
+    prefetched_batches = list(
+        prefetch_iterator.get_batches(signal_and_target, shuffle=True))
+    assert len(batches) == len(prefetched_batches)
+    for (X, y), (prefetched_X, prefetched_y) in zip(
+            batches, prefetched_batches):
+        np.testing.assert_array_equal(X, prefetched_X)
+        np.testing.assert_array_equal(y, prefetched_y)
+
+
+def test_stack_trials(signal_and_target):
+    stacked_X = _stack_trials(signal_and_target.X, time_axis=1)
+    assert stacked_X.shape == (3, 3, 135)
+    assert stacked_X.dtype == np.float32
+    for trial, stacked_trial in zip(signal_and_target.X, stacked_X):
+        n_times = trial.shape[1]
+        np.testing.assert_array_equal(stacked_trial[:, :n_times], trial)
+        np.testing.assert_array_equal(stacked_trial[:, n_times:], 0)
+    assert _stack_trials(stacked_X, time_axis=1) is stacked_X
+
+
+def test_crops_cover_trials(signal_and_target):
+    iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10)
+    y = [np.arange(trial.shape[1]) for trial in signal_and_target.X]
+    dataset = SignalAndTarget(signal_and_target.X, y)
+    for batch_X, batch_y in iterator.get_batches(dataset, shuffle=False):
+        assert batch_X.shape[1:] == (3, 30, 1)
+        assert batch_y.shape[1:] == (10,)
+        for crop, preds_y in zip(batch_X, batch_y):
+            # the per-sample labels are the sample indices in the trial
+            i_stop = preds_y[-1] + 1
+            matching_trials = [
+                trial for trial in signal_and_target.X
+                if trial.shape[1] >= i_stop and np.array_equal(
+                    trial[:, i_stop - 30:i_stop], crop[:, :, 0])]
+            assert len(matching_trials) == 1
+
+
+@pytest.mark.parametrize("prefetch", [0, 2])
+def test_reuse_buffers_gives_same_batches(signal_and_target, prefetch):
+    iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10)
+    buffer_iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10,
+        prefetch=prefetch, reuse_buffers=True)
+    batches = iterator.get_batches(signal_and_target, shuffle=True)
+    buffer_batches = buffer_iterator.get_batches(
+        signal_and_target, shuffle=True)
+    assert len(batches) == len(buffer_batches) == 8
+    n_batches = 0
+    for (X, y), (buffer_X, buffer_y) in zip(batches, buffer_batches):
+        np.testing.assert_array_equal(X, buffer_X)
+        np.testing.assert_array_equal(y, buffer_y)
+        n_batches += 1
+    assert n_batches == 8
+
+
+def test_prefetch_epoch_stopped_early(signal_and_target):
+    iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10, prefetch=0)
+    prefetch_iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10, prefetch=2)
+    other_prefetch_iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10, prefetch=2)
+    # abandon the first epoch while its producer is still creating batches
+    for i_batch, _ in enumerate(
+            prefetch_iterator.get_batches(signal_and_target, shuffle=False)):
+        if i_batch == 1:
+            break
+    batches = iterator.get_batches(signal_and_target, shuffle=False)
+    prefetched_batches = prefetch_iterator.get_batches(
+        signal_and_target, shuffle=False)
+    other_prefetched_batches = other_prefetch_iterator.get_batches(
+        signal_and_target, shuffle=False)
+    # two prefetching iterators creating batches at the same time
+    for (X, y), (prefetched_X, prefetched_y), (other_X, other_y) in zip(
+            batches, prefetched_batches, other_prefetched_batches):
+        np.testing.assert_array_equal(X, prefetched_X)
+        np.testing.assert_array_equal(y, prefetched_y)
+        np.testing.assert_array_equal(X, other_X)
+        np.testing.assert_array_equal(y, other_y)
+
+
+def test_dataset_changed_between_epochs(signal_and_target):
+    iterator = CropsFromTrialsIterator(
+        batch_size=4, input_time_length=30, n_preds_per_input=10)
+    dataset = SignalAndTarget(
+        list(signal_and_target.X), list(signal_and_target.y))
+    list(iterator.get_batches(dataset, shuffle=False))
+    # replace a trial in the list
+    dataset.X[0] = np.ones_like(dataset.X[0])
+    batch_X, _ = next(iter(iterator.get_batches(dataset, shuffle=False)))
+    np.testing.assert_array_equal(batch_X[0], 1)
+    # change the values of a trial in place
+    dataset.X[0][:] = 3
+    batch_X, _ = next(iter(iterator.get_batches(dataset, shuffle=False)))
+    np.testing.assert_array_equal(batch_X[0], 3)
+    # append a trial and its label
+    dataset.X.append(np.full((3, 50), 2, dtype=np.float32))
+    dataset.y.append(1)
+    batches = list(iterator.get_batches(dataset, shuffle=False))
+    last_X, last_y = batches[-1]
+    np.testing.assert_array_equal(last_X[-1], 2)
+    assert last_y[-1] == 1
+
+
+def test_prefetch_error_finishes_iteration():
+    def batches():
+        yield 0
+        yield 1
+        raise ValueError("third batch")
+
+    prefetch_iterator = _PrefetchIterator(batches(), prefetch=2)
+    assert next(prefetch_iterator) == 0
+    assert next(prefetch_iterator) == 1
+    with pytest.raises(ValueError, match="third batch"):
+        next(prefetch_iterator)
+    # like a generator, the iterator is finished after the error
+    with pytest.raises(StopIteration):
+        next(prefetch_iterator)
+    with pytest.raises(StopIteration):
+        next(prefetch_iterator)
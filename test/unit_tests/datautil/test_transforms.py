@@ -5,10 +5,12 @@
 
 from collections import OrderedDict
 
+import mne
 import numpy as np
+import pandas as pd
 import pytest
 
-from braindecode.datasets import MOABBDataset
+from braindecode.datasets import MOABBDataset, BaseDataset, BaseConcatDataset
 from braindecode.datautil.transforms import transform_concat_ds, zscore, scale
 from braindecode.datautil.windowers import create_fixed_length_windows
 
@@ -57,6 +59,34 @@ def test_transform_base_method(base_concat_ds):
     assert base_concat_ds.datasets[0].raw.info['sfreq'] == 50
 
 
+@pytest.fixture
+def lazy_concat_ds(tmpdir):
+    rng = np.random.RandomState(42)
+    info = mne.create_info(
+        ch_names=['0', '1', '2', 'stim'], sfreq=50,
+        ch_types=['eeg', 'eeg', 'eeg', 'stim'])
+    fname = str(tmpdir.join('test-raw.fif'))
+    mne.io.RawArray(data=rng.randn(4, 1000), info=info).save(fname)
+    raw = mne.io.read_raw_fif(fname, preload=False)
+    desc = pd.Series({'subject': 1})
+    return BaseConcatDataset([BaseDataset(raw, desc)])
+
+
+def test_transform_channel_selection_keeps_lazy(lazy_concat_ds):
+    transforms = [
+        ('pick_types', dict(eeg=True, meg=False, stim=False)),
+        ('drop_channels', dict(ch_names=['1'])),
+    ]
+    transform_concat_ds(lazy_concat_ds, transforms)
+    raw = lazy_concat_ds.datasets[0].raw
+    assert not raw.preload
+    assert raw.ch_names == ['0', '2']
+    transform_concat_ds(lazy_concat_ds, [('resample', dict(sfreq=25))])
+    assert raw.preload
+    assert raw.ch_names == ['0', '2']
+    assert raw.info['sfreq'] == 25
+
+
 def test_transform_windows_callable(windows_concat_ds):
     pass
 